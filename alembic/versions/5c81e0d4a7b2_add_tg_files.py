@@ -0,0 +1,32 @@
+"""add tg_files
+
+Revision ID: 5c81e0d4a7b2
+Revises: a02fad34dbaf
+Create Date: 2026-10-17 10:03:11.530217
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "5c81e0d4a7b2"
+down_revision = "a02fad34dbaf"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "tg_files",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("image_hash", sa.String(), nullable=True),
+        sa.Column("file_id", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_tg_files_image_hash"), "tg_files", ["image_hash"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_tg_files_image_hash"), table_name="tg_files")
+    op.drop_table("tg_files")
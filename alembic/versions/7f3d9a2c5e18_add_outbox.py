@@ -0,0 +1,40 @@
+"""add outbox
+
+Revision ID: 7f3d9a2c5e18
+Revises: e4b7c2a91f03
+Create Date: 2026-10-17 11:36:08.114520
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "7f3d9a2c5e18"
+down_revision = "e4b7c2a91f03"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(), nullable=True),
+        sa.Column("trx_id", sa.String(), nullable=True),
+        sa.Column("payload", sa.JSON(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("next_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_outbox_key"), "outbox", ["key"], unique=True)
+    op.create_index(op.f("ix_outbox_status"), "outbox", ["status"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_outbox_status"), table_name="outbox")
+    op.drop_index(op.f("ix_outbox_key"), table_name="outbox")
+    op.drop_table("outbox")
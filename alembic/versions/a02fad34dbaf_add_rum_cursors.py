@@ -0,0 +1,34 @@
+"""add rum_cursors
+
+Revision ID: a02fad34dbaf
+Revises: 3bd351bb17ac
+Create Date: 2026-10-17 09:12:40.218734
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "a02fad34dbaf"
+down_revision = "3bd351bb17ac"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rum_cursors",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("group_id", sa.String(), nullable=True),
+        sa.Column("trx_id", sa.String(), nullable=True),
+        sa.Column("timestamp", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_rum_cursors_group_id"), "rum_cursors", ["group_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_rum_cursors_group_id"), table_name="rum_cursors")
+    op.drop_table("rum_cursors")
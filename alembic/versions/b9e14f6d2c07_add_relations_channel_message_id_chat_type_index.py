@@ -0,0 +1,27 @@
+"""add index of relations (channel_message_id, chat_type)
+
+Revision ID: b9e14f6d2c07
+Revises: 7f3d9a2c5e18
+Create Date: 2026-10-17 12:20:45.381902
+
+"""
+
+from alembic import op
+
+revision = "b9e14f6d2c07"
+down_revision = "7f3d9a2c5e18"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_relations_channel_message_id_chat_type",
+        "relations",
+        ["channel_message_id", "chat_type"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_relations_channel_message_id_chat_type", table_name="relations")
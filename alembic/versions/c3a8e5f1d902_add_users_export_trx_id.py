@@ -0,0 +1,29 @@
+"""add users.export_trx_id, export_count and export_size
+
+Revision ID: c3a8e5f1d902
+Revises: b9e14f6d2c07
+Create Date: 2026-10-17 22:48:13.520417
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "c3a8e5f1d902"
+down_revision = "b9e14f6d2c07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("export_trx_id", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("export_count", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("export_size", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("export_size")
+        batch_op.drop_column("export_count")
+        batch_op.drop_column("export_trx_id")
@@ -0,0 +1,50 @@
+"""add relations.root_post_id and index of rum_post_id
+
+Revision ID: e4b7c2a91f03
+Revises: 5c81e0d4a7b2
+Create Date: 2026-10-17 10:41:52.907316
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "e4b7c2a91f03"
+down_revision = "5c81e0d4a7b2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("relations") as batch_op:
+        batch_op.add_column(sa.Column("root_post_id", sa.String(), nullable=True))
+    op.create_index(op.f("ix_relations_rum_post_id"), "relations", ["rum_post_id"], unique=False)
+
+    # backfill: the rum_post_url of a relation is always the url of its root post
+    relations = sa.table(
+        "relations",
+        sa.column("id", sa.Integer),
+        sa.column("trx_type", sa.String),
+        sa.column("rum_post_id", sa.String),
+        sa.column("rum_post_url", sa.String),
+        sa.column("root_post_id", sa.String),
+    )
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(relations).where(relations.c.rum_post_id.isnot(None))).fetchall()
+    for row in rows:
+        if row.rum_post_url and "/posts/" in row.rum_post_url:
+            root_post_id = row.rum_post_url.rsplit("/posts/", 1)[-1]
+        elif row.trx_type == "post":
+            root_post_id = row.rum_post_id
+        else:
+            continue
+        conn.execute(
+            relations.update().where(relations.c.id == row.id).values(root_post_id=root_post_id)
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_relations_rum_post_id"), table_name="relations")
+    with op.batch_alter_table("relations") as batch_op:
+        batch_op.drop_column("root_post_id")
@@ -0,0 +1,83 @@
+"""benchmark of DBHandle.get_trx_sent, before: three queries without the composite index,
+after: one ordered query with the index of (channel_message_id, chat_type).
+
+python benchmark/bench_get_trx_sent.py [number_of_channel_messages]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from rum_with_telegram.db_handle import DBHandle
+from rum_with_telegram.module import Relation
+
+
+def get_trx_sent_before(db, channel_message_id):
+    relation = db.get_trx_sent_by(channel_message_id, None)
+    if not relation:
+        relation = db.get_trx_sent_by(channel_message_id, "private")
+    if not relation:
+        relation = db.get_trx_sent_by(channel_message_id, "supergroup")
+    return relation
+
+
+def fill(db, num):
+    relations = []
+    for i in range(num):
+        # a channel post sent to rum, its forward in group and some comments
+        relations.append({"channel_message_id": i, "trx_id": f"post{i}", "trx_type": "post"})
+        relations.append(
+            {"channel_message_id": i, "chat_type": "supergroup", "chat_message_id": i * 10}
+        )
+        for j in range(1, 4):
+            relations.append(
+                {
+                    "channel_message_id": i,
+                    "chat_type": "supergroup",
+                    "chat_message_id": i * 10 + j,
+                    "trx_id": f"comment{i}-{j}",
+                    "trx_type": "comment",
+                }
+            )
+    db.add_all(Relation, relations)
+
+
+def bench(func, db, ids):
+    start = time.perf_counter()
+    for i in ids:
+        func(db, i)
+    return (time.perf_counter() - start) / len(ids) * 1e6
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBHandle(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}")
+        fill(db, num)
+        # half of the lookups miss, such as the channel posts not sent yet
+        ids = [random.randrange(num * 2) for _ in range(2000)]
+
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_relations_channel_message_id_chat_type"))
+        before = bench(get_trx_sent_before, db, ids)
+
+        with db.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "CREATE INDEX ix_relations_channel_message_id_chat_type "
+                    "ON relations (channel_message_id, chat_type)"
+                )
+            )
+        after = bench(DBHandle.get_trx_sent, db, ids)
+
+    print(f"relations: {num * 5}, lookups: {len(ids)}")
+    print(f"before: {before:.1f} us/lookup")
+    print(f"after:  {after:.1f} us/lookup ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""benchmark of the process startup, each case runs in a new python process,
+such as the scripts of example: run_commands.py, run_one.py and run_two.py.
+
+python benchmark/bench_startup.py [number_of_runs]
+"""
+
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlencode
+
+CASES = {
+    "import module": "import rum_with_telegram.module",
+    "import DataExchanger": "from rum_with_telegram import DataExchanger",
+    "DataExchanger()": "from rum_with_telegram import DataExchanger\nDataExchanger(CONFIG)",
+    "set_commands": "from rum_with_telegram import DataExchanger\nDataExchanger(CONFIG).app",
+    "handle_rum": (
+        "import asyncio\n"
+        "from rum_with_telegram import DataExchanger\n"
+        "d = DataExchanger(CONFIG)\n"
+        "d.rum_api, d.app\n"
+        "asyncio.run(d.db.get_rum_cursor(d.rum.group.group_id))\n"
+    ),
+}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def fake_seed() -> str:
+    """a seed url which can be decoded, the chain url is never requested"""
+    query = {
+        "v": "1",
+        "e": "0",
+        "n": "0",
+        "c": _b64(os.urandom(32)),
+        "g": _b64(uuid.uuid4().bytes),
+        "k": _b64(os.urandom(33)),
+        "s": _b64(os.urandom(65)),
+        "t": _b64(time.time_ns().to_bytes(8, "big")),
+        "a": "bench",
+        "y": "group_timeline",
+        "u": "http://127.0.0.1:1?jwt=bench",
+    }
+    return "rum://seed?" + urlencode(query)
+
+
+def write_config(tmp: str) -> str:
+    config = {
+        "DB_URL": f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}",
+        "FEED_URL_BASE": "https://example.com",
+        "FEED_TITLE": "bench",
+        "RUM_SEED": fake_seed(),
+        "TG_BOT_TOKEN": "123456:bench",
+        "TG_BOT_NAME": "@bench_bot",
+        "TG_CHANNEL_NAME": "@bench_channel",
+        "TG_GROUP_NAME": "@bench_group",
+    }
+    path = os.path.join(tmp, "config.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return path
+
+
+def bench(code: str, config_file: str, runs: int) -> float:
+    """the min seconds of runs, including the start of python"""
+    code = code.replace("CONFIG", repr(config_file))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = write_config(tmp)
+        baseline = bench("pass", config_file, runs)
+        print(f"python: {baseline * 1000:.0f} ms, min of {runs} runs")
+        for name, code in CASES.items():
+            seconds = bench(code, config_file, runs)
+            print(f"{name}: {seconds * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 import logging
 
-from rum_with_telegram.data_exchanger import DataExchanger
-
 __version__ = "1.0.4"
 __author__ = "liujuanjuan1984"
 
 logger = logging.getLogger(__name__)
 logger.info("Version %s", __version__)
+
+
+def __getattr__(name):
+    # import DataExchanger on first use, so importing a submodule, such as module by alembic,
+    # does not import telegram and the rum clients
+    if name == "DataExchanger":
+        from rum_with_telegram.data_exchanger import DataExchanger
+
+        return DataExchanger
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
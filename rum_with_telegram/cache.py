@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """a thread-safe, size-bounded lru cache, the items expire after ttl seconds if ttl is set.
+    the size is the number of items, or the sum of getsize(value) if getsize is set."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, getsize=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.getsize = getsize
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        value, _, size = self._data.pop(key)
+        self.size -= size
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expire_at, _ = item
+            if expire_at is not None and expire_at < time.monotonic():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expire_at = time.monotonic() + self.ttl if self.ttl else None
+        size = self.getsize(value) if self.getsize else 1
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, expire_at, size)
+            self.size += size
+            while self.size > self.maxsize:
+                self._pop(next(iter(self._data)))
+
+    def add(self, key):
+        """use the cache as a bounded set"""
+        self.set(key, True)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
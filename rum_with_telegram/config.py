@@ -1,10 +1,18 @@
+import asyncio
+import functools
 import json
+import logging
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+
+@dataclass(frozen=True)
 class Config:
+    """the immutable snapshot of config, a new one is created to change it.
+    the lists of userids and pubkeys are frozensets for the membership checks"""
+
     # database url
     DB_URL: str
     # the base url of feed
@@ -26,6 +34,23 @@ class Config:
     BLACK_LIST_TGIDS: list = None
     # whether to print sql statements
     DB_ECHO: bool = False
+    # the threads to run the db queries if the driver of DB_URL is not async, such as sqlite+aiosqlite
+    DB_WORKERS: int = 1
+    # the connection pool of DB_URL; pre-ping checks the connection before use
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 3600
+    DB_POOL_PRE_PING: bool = True
+    # sqlite in WAL mode: the milliseconds to wait for the lock, and the bytes of memory-mapped i/o
+    DB_SQLITE_BUSY_TIMEOUT: int = 5000
+    DB_SQLITE_MMAP_SIZE: int = 64 * 1024 * 1024
+    # the max number of relations pending to insert with one commit, and the seconds to flush them.
+    # 0 to insert at once; the pending are lost if the process is killed
+    DB_WRITE_BUFFER_SIZE: int = 0
+    DB_WRITE_BUFFER_INTERVAL: float = 1.0
+    # the max number of users kept in memory with their used keys, and the seconds to keep them
+    DB_USER_CACHE_SIZE: int = 10000
+    DB_USER_CACHE_TTL: float = 300
     # the default private key of this service to send trx
     ETH_PVTKEY: str = None
     RUM_DELAY_HOURS: int = -3
@@ -38,15 +63,61 @@ class Config:
     TG_CHANNEL_ID: int = None
     TG_GROUP_ID: int = None
     TG_COMMANDS: list = None
+    # the max number of threads to request the rum node
+    RUM_API_WORKERS: int = 4
+    # the max number of user accounts kept in memory to sign trxs
+    RUM_SIGNER_POOL_SIZE: int = 1024
+    # the number of processes to pack images and sign trxs, 0 means in this process.
+    # the script should create DataExchanger under `if __name__ == "__main__":` when it is > 0
+    RUM_SIGN_WORKERS: int = 0
+    # the number of workers to send telegram messages to rum group, and the max attempts of each
+    RUM_OUTBOX_WORKERS: int = 4
+    RUM_OUTBOX_MAX_ATTEMPTS: int = 10
+    # the max number of relayed trx_ids kept in memory to skip the duplicated
+    RUM_SEEN_CACHE_SIZE: int = 10000
+    # the seconds between polls of rum group, backoff when no new trx
+    RUM_POLL_MIN_INTERVAL: float = 1.0
+    RUM_POLL_MAX_INTERVAL: float = 30.0
+    RUM_POLL_BACKOFF: float = 2.0
+    # the max messages per second sent by telegram bot, for all chats, one private chat, one group or channel
+    TG_SEND_GLOBAL_RATE: float = 30
+    TG_SEND_CHAT_RATE: float = 1
+    TG_SEND_GROUP_RATE: float = 0.33
+    # the max bytes and seconds to keep the downloaded telegram photos in memory
+    TG_MEDIA_CACHE_SIZE: int = 32 * 1024 * 1024
+    TG_MEDIA_CACHE_TTL: float = 600
+    # the seconds to cache the pinned post of telegram group
+    TG_PINNED_CACHE_TTL: float = 300
+    # the format of /export_data, "ndjson" or "json", gzip-compressed;
+    # and the max bytes of the file kept in memory before it is written to disk
+    TG_EXPORT_FORMAT: str = "ndjson"
+    TG_EXPORT_SPOOL_SIZE: int = 1024 * 1024
+    # the dir of the export archives, only the new trxs are fetched by the next export of ndjson.
+    # empty to fetch all trxs each time
+    TG_EXPORT_CACHE_DIR: str = "export_cache"
+    # the seconds to cache the token list of an address for /tokens, and the max number of addresses.
+    # admin can refresh them by `/tokens refresh`
+    TG_TOKENS_CACHE_TTL: float = 300
+    TG_TOKENS_CACHE_SIZE: int = 10000
+
+    # the seconds to check the json config file and reload it if modified, 0 to disable.
+    # the fields used to start, such as DB_URL and TG_BOT_TOKEN, still need a restart
+    CONFIG_RELOAD_INTERVAL: float = 2.0
 
     def __post_init__(self):
+        _set = functools.partial(object.__setattr__, self)
         if self.TG_CHANNEL_URL is None:
             name = self.TG_CHANNEL_NAME.replace("@", "")
-            self.TG_CHANNEL_URL = f"https://t.me/{name}"
-        self.ADMIN_USERIDS = self.ADMIN_USERIDS or []
-        self.BLACK_LIST_PUBKEYS = self.BLACK_LIST_PUBKEYS or []
-        self.BLACK_LIST_TGIDS = self.BLACK_LIST_TGIDS or []
-        self.WHITELIST = self.WHITELIST or []
+            _set("TG_CHANNEL_URL", f"https://t.me/{name}")
+        _set("ADMIN_USERIDS", frozenset(self.ADMIN_USERIDS or []))
+        _set("BLACK_LIST_PUBKEYS", frozenset(self.BLACK_LIST_PUBKEYS or []))
+        _set("BLACK_LIST_TGIDS", frozenset(self.BLACK_LIST_TGIDS or []))
+        _set("WHITELIST", frozenset(self.WHITELIST or []))
+        _set("TG_COMMANDS", tuple(tuple(i) for i in self.TG_COMMANDS or []))
+
+    def diff(self, other) -> list:
+        """the names of the fields which are different from other"""
+        return [f.name for f in fields(self) if getattr(self, f.name) != getattr(other, f.name)]
 
 
 def read_json(json_file: str):
@@ -67,3 +138,43 @@ def get_config(json_file: str):
     data = read_json(json_file)
     config = Config(**data)
     return config
+
+
+class ConfigWatcher:
+    """check the mtime of the json config file every interval seconds, and call on_change with
+    the new Config if it is modified. the file which fails to load is logged and skipped."""
+
+    def __init__(self, json_file: str, on_change, interval: float = 2.0):
+        self.json_file = json_file
+        self.on_change = on_change
+        self.interval = interval
+        self.task = None
+
+    def _stat(self):
+        stat = os.stat(self.json_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.ensure_future(self._watch())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _watch(self):
+        last = self._stat()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                stat = self._stat()
+                if stat == last:
+                    continue
+                last = stat
+                config = get_config(self.json_file)
+            except Exception as err:
+                logger.warning("reload config %s error: %s", self.json_file, err)
+                continue
+            self.on_change(config)
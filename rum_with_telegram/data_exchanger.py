@@ -1,22 +1,31 @@
 import asyncio
 import base64
 import datetime
-import io
-import json
+import hashlib
 import logging
+import math
+from types import SimpleNamespace
 
-from quorum_data_py import feed, get_trx_type, util
-from quorum_eth_py import RumEthChainBrowser
-from quorum_mininode_py import MiniNode, pvtkey_to_pubkey
-from telegram import Bot, Update
+from telegram import InputMediaPhoto, Update
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 
-from rum_with_telegram.config import get_config
-from rum_with_telegram.db_handle import DBHandle
-from rum_with_telegram.module import Relation, UsedKey
+from rum_with_telegram.cache import LRUCache
+from rum_with_telegram.config import ConfigWatcher, get_config
+from rum_with_telegram.exporter import ExportArchive, export_filename, export_trxs
+from rum_with_telegram.media import MediaCache
+from rum_with_telegram.module import Relation
+from rum_with_telegram.outbox import OutboxWorkers
+from rum_with_telegram.scheduler import PollScheduler
+from rum_with_telegram.sender import PRIORITY_REPLY, SendQueue
+from rum_with_telegram.tokens import TokenBalances
+from rum_with_telegram.waiters import Waiters
 
 logger = logging.getLogger(__name__)
 
+# the BadRequest messages of a file_id which is refused, such as one of another bot
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file_id")
+
 
 class DataExchanger:
     """the data exchanger between telegram bot/channel/chat-group and rum group-chain"""
@@ -28,53 +37,186 @@ class DataExchanger:
         self.config = config or get_config(json_config_file)
         if not self.config:
             raise Exception("config is None")
-        self.rum = MiniNode(self.config.RUM_SEED, self.config.ETH_PVTKEY)
-        self.app = Application.builder().token(self.config.TG_BOT_TOKEN).build()
-        self.db = DBHandle(self.config.DB_URL, echo=self.config.DB_ECHO)
+        self.config_watcher = (
+            ConfigWatcher(json_config_file, self._reload_config, self.config.CONFIG_RELOAD_INTERVAL)
+            if json_config_file
+            else None
+        )
+        # the clients are created on first use, so a script needs only what it uses
+        self._rum = None
+        self._rum_api = None
+        self._app = None
+        self._db = None
+        self._outbox = None
         self.start_trx = None
-
-    def _get_origin_post_id(self, rum_post_id: str):
+        self.seen_trxs = LRUCache(self.config.RUM_SEEN_CACHE_SIZE)
+        self.scheduler = PollScheduler(
+            self.config.RUM_POLL_MIN_INTERVAL,
+            self.config.RUM_POLL_MAX_INTERVAL,
+            self.config.RUM_POLL_BACKOFF,
+        )
+        self.sender = SendQueue(
+            self.config.TG_SEND_GLOBAL_RATE,
+            self.config.TG_SEND_CHAT_RATE,
+            self.config.TG_SEND_GROUP_RATE,
+        )
+        self.relation_waiters = Waiters()
+        self.pinned_thread = LRUCache(1, self.config.TG_PINNED_CACHE_TTL)
+        self.media = MediaCache(self.config.TG_MEDIA_CACHE_SIZE, self.config.TG_MEDIA_CACHE_TTL)
+        self.token_balances = TokenBalances(
+            self.config.TG_TOKENS_CACHE_TTL, self.config.TG_TOKENS_CACHE_SIZE
+        )
+        self.exports = (
+            ExportArchive(self.config.TG_EXPORT_CACHE_DIR)
+            if self.config.TG_EXPORT_CACHE_DIR
+            else None
+        )
+        self.export_locks = {}
+
+    @property
+    def rum(self):
+        """the MiniNode of rum group"""
+        if self._rum is None:
+            from quorum_mininode_py import MiniNode
+
+            self._rum = MiniNode(self.config.RUM_SEED, self.config.ETH_PVTKEY)
+        return self._rum
+
+    @property
+    def rum_api(self):
+        if self._rum_api is None:
+            from rum_with_telegram.rum_client import AsyncRumAPI
+
+            self._rum_api = AsyncRumAPI(
+                self.rum,
+                self.config.RUM_API_WORKERS,
+                self.config.RUM_SIGNER_POOL_SIZE,
+                self.config.RUM_SIGN_WORKERS,
+            )
+        return self._rum_api
+
+    @property
+    def app(self):
+        """the telegram Application"""
+        if self._app is None:
+            self._app = (
+                Application.builder()
+                .token(self.config.TG_BOT_TOKEN)
+                .post_init(self._post_init)
+                .post_shutdown(self._post_shutdown)
+                .build()
+            )
+        return self._app
+
+    @property
+    def db(self):
+        if self._db is None:
+            from rum_with_telegram.db_handle import AsyncDBHandle
+
+            self._db = AsyncDBHandle(
+                self.config.DB_URL,
+                echo=self.config.DB_ECHO,
+                max_workers=self.config.DB_WORKERS,
+                pool_options={
+                    "pool_size": self.config.DB_POOL_SIZE,
+                    "max_overflow": self.config.DB_MAX_OVERFLOW,
+                    "pool_recycle": self.config.DB_POOL_RECYCLE,
+                    "pool_pre_ping": self.config.DB_POOL_PRE_PING,
+                },
+                sqlite_pragmas={
+                    "busy_timeout": self.config.DB_SQLITE_BUSY_TIMEOUT,
+                    "mmap_size": self.config.DB_SQLITE_MMAP_SIZE,
+                },
+                buffer_size=self.config.DB_WRITE_BUFFER_SIZE,
+                flush_interval=self.config.DB_WRITE_BUFFER_INTERVAL,
+                user_cache_size=self.config.DB_USER_CACHE_SIZE,
+                user_cache_ttl=self.config.DB_USER_CACHE_TTL,
+            )
+        return self._db
+
+    @property
+    def outbox(self):
+        if self._outbox is None:
+            self._outbox = OutboxWorkers(
+                self.db,
+                self._handle_outbox,
+                self.config.RUM_OUTBOX_WORKERS,
+                self.config.RUM_OUTBOX_MAX_ATTEMPTS,
+            )
+        return self._outbox
+
+    def _reload_config(self, config):
+        """swap the config snapshot, the handlers running keep the one they have read"""
+        changed = config.diff(self.config)
+        if changed:
+            self.config = config
+            logger.info("config reloaded: %s", changed)
+
+    async def _post_init(self, application):
+        self.outbox.start()
+        if self.config_watcher:
+            self.config_watcher.start()
+
+    async def _post_shutdown(self, application):
+        if self.config_watcher:
+            await self.config_watcher.stop()
+        if self._outbox is not None:
+            await self._outbox.stop()
+        if self._db is not None:
+            await self._db.close()
+        if self._rum_api is not None:
+            self._rum_api.close()
+            self._rum_api = None
+
+    async def _get_origin_post_id(self, rum_post_id: str):
         """get the origin post id for trx"""
         logger.info("get origin post id for %s", rum_post_id)
         if not rum_post_id:
             return None
-        obj = self.db.get_first(Relation, {"rum_post_id": rum_post_id}, "rum_post_id")
+        obj = await self.db.get_first(Relation, {"rum_post_id": rum_post_id}, "rum_post_id")
         if obj:
+            if obj.root_post_id:
+                return obj.root_post_id
             if obj.trx_type == "post":
                 return obj.rum_post_id
             if obj.trx_type == "comment":
-                trx = self.rum.api.trx(obj.trx_id)
+                trx = await self.rum_api.trx(obj.trx_id)
                 rum_post_id = trx["Data"]["object"]["inreplyto"]["id"]
-                return self._get_origin_post_id(rum_post_id)
+                return await self._get_origin_post_id(rum_post_id)
         logger.warning("failed!!! get origin post id for %s", rum_post_id)
         return None
 
     async def send_to_rum(
         self,
-        context,
-        message,
-        userid,
+        bot,
+        text,
+        photo=None,
+        userid=None,
         username=None,
         reply_id=None,
         origin=None,
+        trx_id=None,
+        post_id=None,
     ):
-        """send text as trx to rum group chain"""
+        """send text and photo as trx to rum group chain"""
+        from quorum_data_py import feed
+
         logger.info("start send_to_rum")
-        user = self.db.init_user(userid, username)
-        self.rum.change_account(user.pvtkey)
+        user = await self.db.init_user(userid, username)
+        # resolved before posting, so a retry after a failed lookup does not post again
+        root_post_id = await self._get_origin_post_id(reply_id)
 
-        text = message.text or message.caption or ""
-        if message.photo:
-            image = await context.bot.get_file(message.photo[-1].file_id)
-            image = bytes(await image.download_as_bytearray())
-        else:
-            image = None
+        image = await self.media.download(bot, photo) if photo else None
         images = [image] if image else None
         if reply_id:
-            data = feed.reply(content=text, images=images, reply_id=reply_id)
+            data = await self.rum_api.run_cpu(
+                feed.reply, content=text, images=images, reply_id=reply_id, post_id=post_id
+            )
         else:
             text += f" {self.config.RUM_POST_FOOTER}"
-            data = feed.new_post(content=text, images=images)
+            data = await self.rum_api.run_cpu(
+                feed.new_post, content=text, images=images, post_id=post_id
+            )
         if origin:
             data["origin"] = {
                 "type": "telegram",
@@ -82,23 +224,89 @@ class DataExchanger:
                 "url": f"{self.config.TG_CHANNEL_URL}/{origin}",
             }
 
-        resp = self.rum.api.post_content(data)
-        post_id = self._get_origin_post_id(reply_id) or data["object"]["id"]
-        rum_post_url = f"{self.config.FEED_URL_BASE}/posts/{post_id}"
+        resp = await self.rum_api.post_content(data, trx_id, pvtkey=user.pvtkey)
+        root_post_id = root_post_id or data["object"]["id"]
+        rum_post_url = f"{self.config.FEED_URL_BASE}/posts/{root_post_id}"
         logger.info("success: send_to_rum %s", resp["trx_id"])
         return {
             "group_id": self.rum.group.group_id,
             "trx_id": resp["trx_id"],
             "rum_post_id": data["object"]["id"],
             "rum_post_url": rum_post_url,
+            "root_post_id": root_post_id,
             "user_id": userid,
-            "pubkey": self.rum.account.pubkey,
+            "pubkey": user.pubkey,
             "trx_type": "post" if not reply_id else "comment",
         }
 
+    async def _put_outbox(self, message, userid, username=None, reply_to=None, **kwargs):
+        """put the message to outbox, which will be sent to rum group by the outbox workers.
+        reply_to is the channel_message_id to comment, resolved again by the worker if needed"""
+        photo = message.photo[-1] if message.photo else None
+        payload = {
+            "text": message.text or message.caption or "",
+            "photo": (
+                {"file_id": photo.file_id, "file_unique_id": photo.file_unique_id}
+                if photo
+                else None
+            ),
+            "userid": userid,
+            "username": username,
+            "reply_to": reply_to,
+            **kwargs,
+        }
+        edited_at = int(message.edit_date.timestamp()) if message.edit_date else 0
+        key = f"{message.chat.id}:{message.message_id}:{edited_at}"
+        result = await self.outbox.put(key, payload)
+        logger.info("put outbox %s %s", key, result)
+        return result
+
+    async def _handle_outbox(self, item):
+        """send one outbox item to rum group, then save the relation and reply the post url"""
+        payload = item.payload
+        reply_id = payload.get("reply_id")
+        if not reply_id and payload.get("reply_to"):
+            obj = await self.db.get_trx_sent(payload["reply_to"])
+            reply_id = obj.rum_post_id if obj else None
+        photo = payload.get("photo")
+        relation = await self.send_to_rum(
+            self.app.bot,
+            payload["text"],
+            SimpleNamespace(**photo) if photo else None,
+            payload["userid"],
+            payload.get("username"),
+            reply_id,
+            payload.get("origin"),
+            item.trx_id,
+            payload["post_id"],
+        )
+        relation.update(payload.get("relation") or {})
+        result = await self.db.add(Relation, relation)
+        logger.info("add relation %s outbox %s", result, item.key)
+        if relation.get("channel_message_id"):
+            self.relation_waiters.resolve(relation["channel_message_id"], relation["rum_post_url"])
+        reply = payload.get("reply")
+        if reply:
+            try:
+                await self._comment_with_feedurl(
+                    self.app.bot,
+                    reply.get("extend_text"),
+                    reply["chat_id"],
+                    reply["message_id"],
+                    relation.get("rum_post_url"),
+                )
+            except Exception as err:
+                logger.warning("reply post url of outbox %s error: %s", item.key, err)
+
+    async def _reply_text(self, message, text, **kwargs):
+        """reply to user through the send queue"""
+        return await self.sender.send(
+            message.chat_id, message.reply_text, text, priority=PRIORITY_REPLY, **kwargs
+        )
+
     async def _comment_with_feedurl(
         self,
-        context,
+        bot,
         extend_text: str,
         userid,
         reply_to_message_id,
@@ -110,7 +318,10 @@ class DataExchanger:
         reply = f"⚜️ Success to blockchain.\n👉[{self.config.FEED_TITLE}]({rum_post_url})" + (
             extend_text or ""
         )
-        await context.bot.send_message(
+        await self.sender.send(
+            userid,
+            bot.send_message,
+            priority=PRIORITY_REPLY,
             chat_id=userid,
             text=reply,
             parse_mode="Markdown",
@@ -123,48 +334,138 @@ class DataExchanger:
         if not self.config.RUM_TO_TG:
             logger.warning("config.RUM_TO_TG is False")
             return
+        self.seen_trxs.update(await self.db.get_recent_trx_ids(self.config.RUM_SEEN_CACHE_SIZE))
         if self.start_trx is None:
-            trxs = self.rum.api.get_content(num=20, reverse=True)
-            if trxs:
-                self.start_trx = trxs[-1]["TrxId"]
+            cursor = await self.db.get_rum_cursor(self.rum.group.group_id)
+            if cursor:
+                self.start_trx = cursor.trx_id
+                logger.info("handle_rum resume from %s", self.start_trx)
+            else:
+                trxs = await self.rum_api.get_content(num=20, reverse=True)
+                if trxs:
+                    self.start_trx = trxs[-1]["TrxId"]
         _trx_id = self.start_trx
-        while True:
-            if self.start_trx != _trx_id:
-                logger.info("handle_rum %s", self.start_trx)
-                _trx_id = self.start_trx
-            start_trx = await self._handle_rum(self.start_trx)
-            if start_trx == self.start_trx:
-                await asyncio.sleep(1)
-            self.start_trx = start_trx
+        if self.config_watcher:
+            self.config_watcher.start()
+        try:
+            while True:
+                if self.start_trx != _trx_id:
+                    logger.info(
+                        "handle_rum %s interval %s lag %s",
+                        self.start_trx,
+                        self.scheduler.interval,
+                        self.scheduler.lag,
+                    )
+                    _trx_id = self.start_trx
+                start_trx = await self._handle_rum(self.start_trx)
+                self.start_trx = start_trx
+                await self.scheduler.wait()
+        finally:
+            if self.config_watcher:
+                await self.config_watcher.stop()
+            await self.db.flush()
+            if self._rum_api is not None:
+                self._rum_api.close()
+                self._rum_api = None
+
+    def _is_relay_trx(self, trx):
+        """whether the trx from rum group should be sent to telegram channel"""
+        from quorum_data_py import get_trx_type, util
+
+        if self.config.POST_AUTH_TYPE == "whitelist":
+            if trx["SenderPubkey"] not in self.config.WHITELIST:
+                return False
+        if trx["SenderPubkey"] in self.config.BLACK_LIST_PUBKEYS:
+            return False
+        if get_trx_type(trx) != "post":
+            return False
+        _tag = self.config.RUM_TO_TG_TAG
+        if _tag and _tag not in trx["Data"]["object"]["content"]:
+            return False
+        trx_dt = util.get_published_datetime(trx)
+        if trx_dt < datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            hours=self.config.RUM_DELAY_HOURS
+        ):
+            return False
+        origin_url = trx["Data"].get("origin", {}).get("url", "")
+        if self.config.TG_CHANNEL_URL in origin_url:
+            return False
+        _text = trx["Data"]["object"].get("content", "")
+        _images = trx["Data"]["object"].get("image", [])
+        if not _text and not _images:
+            return False
+        return True
+
+    async def _send_photo_message(self, photos: list, caption: str = None, is_album: bool = True):
+        """send one photo, or one album of 2 to 10 photos with the caption on the first one"""
+        if not is_album:
+            resp = await self.sender.send(
+                self.config.TG_CHANNEL_NAME,
+                self.app.bot.send_photo,
+                chat_id=self.config.TG_CHANNEL_NAME,
+                photo=photos[0],
+                caption=caption,
+            )
+            return [resp]
+        media = [InputMediaPhoto(photo) for photo in photos]
+        if caption is not None:
+            media[0] = InputMediaPhoto(photos[0], caption=caption)
+        return await self.sender.send(
+            self.config.TG_CHANNEL_NAME,
+            self.app.bot.send_media_group,
+            chat_id=self.config.TG_CHANNEL_NAME,
+            media=media,
+        )
+
+    async def _send_photos(self, photos: list, caption: str):
+        """send photos to telegram channel, as one album if more than one.
+        the images uploaded before are sent by file_id instead of bytes,
+        and uploaded again if the file_id is refused, such as one of another bot."""
+        hashes = [hashlib.sha256(photo).hexdigest() for photo in photos]
+        file_ids = await self.db.get_file_ids(hashes)
+        messages = []
+        # an album has 2 to 10 photos, so the photos are split evenly, such as 11 into 6 and 5;
+        # the caption is shown with the first message
+        size = math.ceil(len(photos) / math.ceil(len(photos) / 10))
+        for i in range(0, len(photos), size):
+            chunk, chunk_hashes = photos[i : i + size], hashes[i : i + size]
+            chunk_caption = caption if i == 0 else None
+            is_album = len(chunk) > 1
+            cached = [file_ids.get(h, photo) for h, photo in zip(chunk_hashes, chunk)]
+            try:
+                resp = await self._send_photo_message(cached, chunk_caption, is_album)
+            except BadRequest as err:
+                if not any(h in file_ids for h in chunk_hashes) or not any(
+                    e in err.message.lower() for e in FILE_ID_ERRORS
+                ):
+                    raise
+                logger.warning("send photos by file_id error: %s, upload them again", err)
+                for h in chunk_hashes:
+                    file_ids.pop(h, None)
+                resp = await self._send_photo_message(chunk, chunk_caption, is_album)
+            messages.extend(resp)
+        new_file_ids = {
+            h: message.photo[-1].file_id
+            for h, message in zip(hashes, messages)
+            if h not in file_ids and message.photo
+        }
+        await self.db.add_file_ids(new_file_ids)
+        return messages
 
     async def _handle_rum(self, start_trx):
-        trxs = self.rum.api.get_content(num=20, start_trx=start_trx)
-        for trx in trxs:
-            start_trx = trx["TrxId"]
-            if self.config.POST_AUTH_TYPE == "whitelist":
-                if trx["SenderPubkey"] not in self.config.WHITELIST:
-                    continue
-            if trx["SenderPubkey"] in self.config.BLACK_LIST_PUBKEYS:
-                continue
-            if get_trx_type(trx) != "post":
-                continue
-            _tag = self.config.RUM_TO_TG_TAG
-            if _tag and _tag not in trx["Data"]["object"]["content"]:
-                continue
-            trx_dt = util.get_published_datetime(trx)
-            if trx_dt < datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
-                hours=self.config.RUM_DELAY_HOURS
-            ):
-                continue
-            origin_url = trx["Data"].get("origin", {}).get("url", "")
-            if self.config.TG_CHANNEL_URL in origin_url:
+        trxs = await self.rum_api.get_content(num=20, start_trx=start_trx)
+        trxs_to_relay = [
+            trx for trx in trxs if trx["TrxId"] not in self.seen_trxs and self._is_relay_trx(trx)
+        ]
+        # one query for the whole page instead of one for each trx
+        self.seen_trxs.update(
+            await self.db.get_existing_trx_ids([i["TrxId"] for i in trxs_to_relay])
+        )
+        for trx in trxs_to_relay:
+            if trx["TrxId"] in self.seen_trxs:
                 continue
             _text = trx["Data"]["object"].get("content", "")
             _images = trx["Data"]["object"].get("image", [])
-            if not _text and not _images:
-                continue
-            if self.db.is_exist(Relation, {"trx_id": trx["TrxId"]}, "trx_id"):
-                continue
             post_url = f'{self.config.FEED_URL_BASE}/posts/{trx["Data"]["object"]["id"]}'
             logger.info("new post from rum %s", post_url)
             relation = {
@@ -172,6 +473,7 @@ class DataExchanger:
                 "trx_id": trx["TrxId"],
                 "rum_post_id": trx["Data"]["object"]["id"],
                 "rum_post_url": post_url,
+                "root_post_id": trx["Data"]["object"]["id"],
                 "user_id": self.config.TG_CHANNEL_ID,
                 "pubkey": trx["SenderPubkey"],
                 "trx_type": "post",
@@ -179,32 +481,30 @@ class DataExchanger:
             if _images:
                 if isinstance(_images, dict):
                     _images = [_images]
-                for i, _image in enumerate(_images):
-                    resp = await self.app.bot.send_photo(
-                        chat_id=self.config.TG_CHANNEL_NAME,
-                        photo=base64.b64decode(_image["content"].encode("utf-8")),
-                        caption=f"{i+1}/{len(_images)} {_text}",
-                    )
-                    relation.update(
-                        {
-                            "channel_message_id": resp.message_id,
-                        }
-                    )
-                    result = self.db.add(Relation, relation)
-                    logger.info("add relation %s channel %s", result, resp.message_id)
-            elif _text:
-                resp = await self.app.bot.send_message(
+                photos = [base64.b64decode(i["content"].encode("utf-8")) for i in _images]
+                messages = await self._send_photos(photos, _text)
+            else:
+                resp = await self.sender.send(
+                    self.config.TG_CHANNEL_NAME,
+                    self.app.bot.send_message,
                     chat_id=self.config.TG_CHANNEL_NAME,
                     text=_text,
                 )
-                relation.update(
-                    {
-                        "channel_message_id": resp.message_id,
-                    }
-                )
-                result = self.db.add(Relation, relation)
-                logger.info("add relation %s channel %s ", result, resp.message_id)
-            await asyncio.sleep(1)
+                messages = [resp]
+            relations = [dict(relation, channel_message_id=i.message_id) for i in messages]
+            result = await self.db.add_all(Relation, relations)
+            logger.info("add relation %s channel %s", result, [i.message_id for i in messages])
+            for message in messages:
+                self.relation_waiters.resolve(message.message_id, post_url)
+            self.seen_trxs.add(trx["TrxId"])
+        self.scheduler.update(len(trxs), trxs[-1].get("TimeStamp") if trxs else None)
+        if trxs:
+            start_trx = trxs[-1]["TrxId"]
+            # checkpoint per page, so a restart resumes from here; after the relations of the page
+            await self.db.flush()
+            await self.db.update_rum_cursor(
+                self.rum.group.group_id, start_trx, str(trxs[-1].get("TimeStamp", ""))
+            )
         return start_trx
 
     async def handle_private_chat(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -213,12 +513,13 @@ class DataExchanger:
         logger.info("handle_private_chat %s", message_id)
         userid = update.message.from_user.id
         if userid in self.config.BLACK_LIST_TGIDS:
-            await update.message.reply_text("You are in the blacklist.")
+            await self._reply_text(update.message, "You are in the blacklist.")
             return
         if self.config.POST_AUTH_TYPE == "whitelist":
             if userid not in self.config.WHITELIST:
-                await update.message.reply_text(
-                    f"You are not in the whitelist. Your content will not be post to channel.\n You can leave a comment to any post of the channel.@{self.config.TG_CHANNEL_NAME}"
+                await self._reply_text(
+                    update.message,
+                    f"You are not in the whitelist. Your content will not be post to channel.\n You can leave a comment to any post of the channel.@{self.config.TG_CHANNEL_NAME}",
                 )
                 return
         _first_name = update.message.from_user.first_name
@@ -231,37 +532,38 @@ class DataExchanger:
         text = f"{_text}\n\nFrom {_fullname} through {self.config.TG_BOT_NAME}"
         _photo = update.message.photo
         if _photo:
-            image = await context.bot.get_file(_photo[-1].file_id)
-            image = bytes(await image.download_as_bytearray())
-            resp = await context.bot.send_photo(
-                chat_id=self.config.TG_CHANNEL_NAME, photo=image, caption=text
+            image = await self.media.download(context.bot, _photo[-1])
+            resp = await self.sender.send(
+                self.config.TG_CHANNEL_NAME,
+                context.bot.send_photo,
+                chat_id=self.config.TG_CHANNEL_NAME,
+                photo=image,
+                caption=text,
             )
         else:
             image = None
             text = f"{_text}\nFrom {_fullname} through {self.config.TG_BOT_NAME}"
-            resp = await context.bot.send_message(chat_id=self.config.TG_CHANNEL_NAME, text=text)
+            resp = await self.sender.send(
+                self.config.TG_CHANNEL_NAME,
+                context.bot.send_message,
+                chat_id=self.config.TG_CHANNEL_NAME,
+                text=text,
+            )
 
-        relation = await self.send_to_rum(
-            context,
+        await self._put_outbox(
             update.message,
             userid,
             origin=resp.message_id,
-        )
-        relation.update(
-            {
+            relation={
                 "chat_type": "private",
                 "chat_message_id": message_id,
                 "channel_message_id": resp.message_id,
-            }
-        )
-        result = self.db.add(Relation, relation)
-        logger.info("add relation %s  channel %s chat %s", result, resp.message_id, message_id)
-        await self._comment_with_feedurl(
-            context,
-            f" and to [{self.config.TG_CHANNEL_NAME}]({self.config.TG_CHANNEL_URL}/{resp.message_id})",
-            userid,
-            message_id,
-            relation.get("rum_post_url"),
+            },
+            reply={
+                "extend_text": f" and to [{self.config.TG_CHANNEL_NAME}]({self.config.TG_CHANNEL_URL}/{resp.message_id})",
+                "chat_id": userid,
+                "message_id": message_id,
+            },
         )
 
     async def _handle_channel_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -271,20 +573,30 @@ class DataExchanger:
         userid = update.channel_post.chat.id
         # send to rum
         channel_message_id = update.channel_post.message_id
-        relation = await self.send_to_rum(
-            context,
+        await self._put_outbox(
             update.channel_post,
             userid,
             update.channel_post.chat.username,
             origin=channel_message_id,
+            relation={"channel_message_id": channel_message_id},
         )
-        relation.update(
-            {
-                "channel_message_id": channel_message_id,
-            }
-        )
-        result = self.db.add(Relation, relation)
-        logger.info("add relation %s  channel %s ", result, channel_message_id)
+
+    async def _wait_rum_post_url(self, channel_message_id, timeout: float = 5):
+        """wait for the channel post to be sent to rum group.
+        it is resolved by the writer in this process, the db is checked once a second for others."""
+        waiter = self.relation_waiters.wait(channel_message_id)
+        try:
+            for _ in range(int(timeout)):
+                obj = await self.db.get_trx_sent(channel_message_id)
+                if obj and obj.rum_post_url:
+                    return obj.rum_post_url
+                try:
+                    return await asyncio.wait_for(asyncio.shield(waiter), 1)
+                except asyncio.TimeoutError:
+                    continue
+            return None
+        finally:
+            self.relation_waiters.discard(channel_message_id, waiter)
 
     async def handle_channel_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """send message to rum group"""
@@ -296,31 +608,21 @@ class DataExchanger:
         logger.info("handle_channel_message %s", message.message_id)
         channel_message_id = message.forward_from_message_id
 
-        rum_post_url = None
         # send reply to user in group chat
-        for i in range(50):
-            obj = self.db.get_trx_sent(channel_message_id)
-            if not obj:
-                await asyncio.sleep(0.1)
-                continue
-            rum_post_url = obj.rum_post_url
-            if not rum_post_url:
-                await asyncio.sleep(0.1)
-            else:
-                break
+        rum_post_url = await self._wait_rum_post_url(channel_message_id)
         if not rum_post_url:
-            logger.warning("%s not found channel_message_id %s", i, channel_message_id)
+            logger.warning("not found channel_message_id %s", channel_message_id)
         else:
             logger.info("found rum_post_url %s", rum_post_url)
         await self._comment_with_feedurl(
-            context, "", message.chat.id, message.message_id, rum_post_url
+            context.bot, "", message.chat.id, message.message_id, rum_post_url
         )
         relation = {
             "chat_message_id": message.message_id,
             "chat_type": message.chat.type,
             "channel_message_id": channel_message_id,
         }
-        result = self.db.add(Relation, relation)
+        result = await self.db.add(Relation, relation)
         logger.info(
             "add relation %s  channel %s chat %s", result, channel_message_id, message.message_id
         )
@@ -337,12 +639,12 @@ class DataExchanger:
 
         # comment to channel post
         if channel_message_id:
-            obj = self.db.get_trx_sent(channel_message_id)
+            obj = await self.db.get_trx_sent(channel_message_id)
             reply_id = obj.rum_post_id if obj else None
             logger.info("reply %s to channel_message_id %s", reply_id, channel_message_id)
         # comment to reply
         elif reply_chat_message_id:
-            obj = self.db.get_first(
+            obj = await self.db.get_first(
                 Relation,
                 {"chat_message_id": reply_chat_message_id, "trx_type": "comment"},
                 "chat_message_id",
@@ -357,36 +659,53 @@ class DataExchanger:
                     channel_message_id,
                 )
                 if reply_id is None and channel_message_id:
-                    obj = self.db.get_trx_sent(channel_message_id)
+                    obj = await self.db.get_trx_sent(channel_message_id)
                     reply_id = obj.rum_post_id
                     logger.info("reply_id reset %s", reply_id)
 
-        relation = await self.send_to_rum(
-            context,
+        await self._put_outbox(
             message,
             userid,
             username,
-            reply_id,
-            channel_message_id,
-        )
-        relation.update(
-            {
+            reply_to=channel_message_id,
+            reply_id=reply_id,
+            origin=channel_message_id,
+            relation={
                 "chat_message_id": message.message_id,
                 "chat_type": message.chat.type,
                 "channel_message_id": channel_message_id,
-            }
-        )
-        result = self.db.add(Relation, relation)
-        logger.info(
-            "add relation %s  channel %s chat %s", result, channel_message_id, message.message_id
+            },
         )
 
+    async def _get_pinned_thread(self, bot):
+        """the channel_message_id and rum_post_id of the pinned post of group, cached for a while"""
+        thread = self.pinned_thread.get(self.config.TG_GROUP_ID)
+        if thread is None:
+            chat = await bot.get_chat(self.config.TG_GROUP_ID)
+            pinned = chat.pinned_message
+            thread = (pinned.forward_from_message_id if pinned else None, None)
+            self.pinned_thread.set(self.config.TG_GROUP_ID, thread)
+        channel_message_id, rum_post_id = thread
+        if channel_message_id and not rum_post_id:
+            obj = await self.db.get_trx_sent(channel_message_id)
+            if obj and obj.rum_post_id:
+                rum_post_id = obj.rum_post_id
+                self.pinned_thread.set(self.config.TG_GROUP_ID, (channel_message_id, rum_post_id))
+        return channel_message_id, rum_post_id
+
+    async def handle_pinned_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """a message is pinned in group, reset the cached pinned thread"""
+        message = update.message
+        logger.info("handle_pinned_message %s", message.pinned_message.message_id)
+        channel_message_id = message.pinned_message.forward_from_message_id
+        self.pinned_thread.set(self.config.TG_GROUP_ID, (channel_message_id, None))
+
     async def handle_group_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """handle group message"""
         message = update.message or update.edited_message
         userid = message.from_user.id
         if userid in self.config.BLACK_LIST_TGIDS:
-            await message.reply_text("You are in the blacklist.")
+            await self._reply_text(message, "You are in the blacklist.")
             return
 
         if message.reply_to_message:
@@ -398,34 +717,20 @@ class DataExchanger:
         )
         username = message.from_user.username
         userid = message.from_user.id
-        bot = Bot(token=context.bot.token)
-        _pinned = await bot.get_chat(self.config.TG_GROUP_ID)
-        _pinned = _pinned.pinned_message
-        channel_message_id = _pinned.forward_from_message_id
-        obj = self.db.get_trx_sent(channel_message_id)
-        if obj:
-            reply_id = obj.rum_post_id
-        else:
-            reply_id = None
+        channel_message_id, reply_id = await self._get_pinned_thread(context.bot)
 
-        relation = await self.send_to_rum(
-            context,
+        await self._put_outbox(
             message,
             userid,
             username,
-            reply_id,
-            channel_message_id,
-        )
-        relation.update(
-            {
+            reply_to=channel_message_id,
+            reply_id=reply_id,
+            origin=channel_message_id,
+            relation={
                 "chat_message_id": message.message_id,
                 "chat_type": message.chat.type,
                 "channel_message_id": channel_message_id,
-            }
-        )
-        result = self.db.add(Relation, relation)
-        logger.info(
-            "add relation %s channel %s chat %s", result, channel_message_id, message.message_id
+            },
         )
 
     async def command_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -433,7 +738,7 @@ class DataExchanger:
         logger.info("start command_start %s", update.message.message_id)
         username = update.message.from_user.username or ""
         text = f"Hello {username}! I'm {self.config.TG_BOT_NAME}. \nI can send your message (such as text, photo) as a new microblog from telgram to the blockchain of RUM network. \nTry to say something to me."
-        await update.message.reply_text(text)
+        await self._reply_text(update.message, text)
 
     async def command_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """/profile command handler, change user name or avatar for the blockchain of rum network"""
@@ -444,34 +749,36 @@ class DataExchanger:
 
         if len(name) > 32 or len(name) < 2:
             reply = "Change your nickname or avatar for blockchian of rum group.\nUse command as `/profile your-nickname` , nickname should be 2-32 characters, and you can add a picture as avatar."
-            await update.message.reply_text(reply)
+            await self._reply_text(update.message, reply)
             return
         _photo = update.message.photo
         if _photo:
-            image = await context.bot.get_file(_photo[-1].file_id)
-            avatar = bytes(await image.download_as_bytearray())
+            avatar = await self.media.download(context.bot, _photo[-1])
         else:
             avatar = None
 
         if name or avatar:
-            user = self.db.init_user(update.message.from_user.id, update.message.from_user.username)
+            user = await self.db.init_user(
+                update.message.from_user.id, update.message.from_user.username
+            )
             address = user.address
-            data = feed.profile(name, avatar, address)
-            self.rum.change_account(user.pvtkey)
-            resp = self.rum.api.post_content(data)
+            from quorum_data_py import feed
+
+            data = await self.rum_api.run_cpu(feed.profile, name, avatar, address)
+            resp = await self.rum_api.post_content(data, pvtkey=user.pvtkey)
             if "trx_id" in resp:
                 reply += f"Profile updated. View {self.config.FEED_URL_BASE}/users/{address}"
             else:
                 reply += "Profile update failed. Please try again later."
 
-        await update.message.reply_text(reply)
+        await self._reply_text(update.message, reply)
 
     async def command_show_pvtkey(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info("start command_show_pvtkey %s", update.message.message_id)
         userid = update.message.from_user.id
         username = update.message.from_user.username
-        user = self.db.init_user(userid, username)
-        used = self.db.get_all(UsedKey, {"user_id": userid}, "user_id") or []
+        user = await self.db.init_user(userid, username)
+        used = await self.db.get_used_keys(userid) or []
         if user:
             text = f"Your private key (please keep it safe) now is: \n```\n{user.pvtkey}\n```\nYour Address (can show to others)  now is:\n```\n{user.address}\n```"
             if used:
@@ -481,19 +788,19 @@ class DataExchanger:
         else:
             text = f"show_key error {userid}"
 
-        await update.message.reply_text(text, parse_mode="Markdown")
+        await self._reply_text(update.message, text, parse_mode="Markdown")
 
     async def command_new_pvtkey(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info("start command_new_pvtkey %s", update.message.message_id)
         userid = update.message.from_user.id
         username = update.message.from_user.username
-        user = self.db.init_user(userid, username, is_cover=True)
+        user = await self.db.init_user(userid, username, is_cover=True)
         if user:
             text = f"Your private key (please keep it safe) is: \n```\n{user.pvtkey}\n```\nYour Address (can show to others) is:\n```\n{user.address}\n```"
         else:
             text = f"new_key error {userid}"
 
-        await update.message.reply_text(text, parse_mode="Markdown")
+        await self._reply_text(update.message, text, parse_mode="Markdown")
 
     async def command_import_pvtkey(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info("start command_import_pvtkey %s", update.message.message_id)
@@ -502,9 +809,11 @@ class DataExchanger:
         _text = update.message.text or update.message.caption or ""
         pvtkey = _text.replace("/import_pvtkey", "").strip("\n '\"")
         text = f"Try to import private key: \n```\n{pvtkey}\n```\n"
+        from quorum_mininode_py import pvtkey_to_pubkey
+
         try:
             pvtkey_to_pubkey(pvtkey)
-            user = self.db.init_user(userid, username, pvtkey=pvtkey, is_cover=True)
+            user = await self.db.init_user(userid, username, pvtkey=pvtkey, is_cover=True)
             if user:
                 text += "Success. Please keep it safe."
             else:
@@ -513,65 +822,119 @@ class DataExchanger:
             logger.error(err)
             text += "Please Use command as `/import_key 0x5ee77ca3c261cdd...adeffaf` . Please check your private key and try again."
 
-        await update.message.reply_text(text, parse_mode="Markdown")
+        await self._reply_text(update.message, text, parse_mode="Markdown")
 
-    def get_all_trxs(self, senders, start_trx=None):
-        trxs = self.rum.api.get_content(senders=senders, start_trx=start_trx, num=20)
-        if len(trxs) == 0:
-            return None
-        for i in trxs:
-            yield i
-        return self.get_all_trxs(senders, trxs[-1]["TrxId"])
+    async def get_all_trxs(self, senders, start_trx=None, num: int = 20):
+        """iterate the trxs of senders page by page, from start_trx or the first"""
+        while True:
+            trxs = await self.rum_api.get_content(senders=senders, start_trx=start_trx, num=num)
+            if not trxs or trxs[-1]["TrxId"] == start_trx:
+                return
+            for trx in trxs:
+                yield trx
+            start_trx = trxs[-1]["TrxId"]
+
+    def _export_lock(self, userid):
+        """the lock of the exports of one user, from the check of export_at to its update"""
+        if userid not in self.export_locks:
+            self.export_locks[userid] = asyncio.Lock()
+        return self.export_locks[userid]
+
+    async def _export_incremental(self, user):
+        """fetch the trxs since the last export and append them to the archive of user.
+        return (count, file) of the whole archive, the file is None if there is no trx"""
+        start_trx, count, size = None, 0, 0
+        # the archive is rebuilt if it is lost or shorter than the db says
+        if user.export_trx_id and self.exports.size(user.pubkey) >= (user.export_size or 0):
+            start_trx, count, size = (
+                user.export_trx_id,
+                user.export_count or 0,
+                user.export_size or 0,
+            )
+        file, new_count, last_trx_id = await export_trxs(
+            self.get_all_trxs([user.pubkey], start_trx), "ndjson", self.config.TG_EXPORT_SPOOL_SIZE
+        )
+        with file:
+            if new_count > 0:
+                size = await self.exports.append(user.pubkey, file, size)
+                count += new_count
+                await self.db.update_user_export(
+                    user.user_id, last_trx_id or start_trx, count, size
+                )
+        logger.info("export %s from %s, %s new trxs", user.user_id, start_trx, new_count)
+        if count == 0:
+            return 0, None
+        return count, self.exports.open(user.pubkey)
 
     async def command_export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info("start command_export_data %s", update.message.message_id)
         userid = update.message.from_user.id
-        user = self.db.get_first_user(userid)
+        # held until export_at is updated, so a quick second command sees the first one
+        async with self._export_lock(userid):
+            user = await self.db.get_first_user(userid)
 
-        if not user:
-            reply = "You have not registered yet. Please use command as `/new_key` to register."
-            await update.message.reply_text(reply)
-            return
+            if not user:
+                reply = "You have not registered yet. Please use command as `/new_key` to register."
+                await self._reply_text(update.message, reply)
+                return
 
-        if user.export_at and user.export_at > datetime.datetime.now() - datetime.timedelta(
-            hours=1
-        ):
-            reply = "You have exported your data in one hour. Please try again later."
-            await update.message.reply_text(reply)
-            return
+            if user.export_at and user.export_at > datetime.datetime.now() - datetime.timedelta(
+                hours=1
+            ):
+                reply = "You have exported your data in one hour. Please try again later."
+                await self._reply_text(update.message, reply)
+                return
 
-        trxs = [i for i in self.get_all_trxs([user.pubkey]) if i]
-        if len(trxs) > 0:
-            # create file-like object in memory
-            data = json.dumps(trxs, indent=4, ensure_ascii=False).encode("utf-8")
-            with io.BytesIO(data) as buffer:
-                buffer.seek(0)
-                # send file to user
-                await context.bot.send_document(
-                    chat_id=update.message.chat_id,
-                    document=buffer,
-                    filename=f"{datetime.date.today()}_export_data_{self.config.TG_BOT_NAME}.json",
-                    reply_to_message_id=update.message.message_id,
+            fmt = self.config.TG_EXPORT_FORMAT
+            if self.exports and fmt == "ndjson":
+                count, document = await self._export_incremental(user)
+            else:
+                # the trxs are streamed to a compressed temp file, page by page
+                document, count, _ = await export_trxs(
+                    self.get_all_trxs([user.pubkey]), fmt, self.config.TG_EXPORT_SPOOL_SIZE
                 )
-            reply = f"You have exported your data, that is {len(trxs)} trxs in blockchain of rum-group.\nYour private key is:\n```{user.pvtkey}```\nPlease keep it safe."
-            self.db.update_user_export_at(userid)
-        else:
-            reply = "You have not any data in blockchain of rum-group."
-        await update.message.reply_text(reply, parse_mode="Markdown")
+            if count > 0:
+                with document:
+                    # send file to user
+                    await self.sender.send(
+                        update.message.chat_id,
+                        context.bot.send_document,
+                        priority=PRIORITY_REPLY,
+                        chat_id=update.message.chat_id,
+                        document=document,
+                        filename=export_filename(
+                            f"{datetime.date.today()}_export_data_{self.config.TG_BOT_NAME}", fmt
+                        ),
+                        reply_to_message_id=update.message.message_id,
+                    )
+                reply = f"You have exported your data, that is {count} trxs in blockchain of rum-group.\nYour private key is:\n```{user.pvtkey}```\nPlease keep it safe."
+                await self.db.update_user_export_at(userid)
+            else:
+                if document is not None:
+                    document.close()
+                reply = "You have not any data in blockchain of rum-group."
+            await self._reply_text(update.message, reply, parse_mode="Markdown")
 
     async def command_tokens(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info("start command_tokens")
         userid = update.message.from_user.id
         username = update.message.from_user.username
-        user = self.db.init_user(userid, username)
-        used = self.db.get_all(UsedKey, {"user_id": userid}, "user_id") or []
+        user = await self.db.init_user(userid, username)
 
         if not user:
             logger.warning("command_tokens error %s", userid)
             return
 
         address = user.address
-        tokens = RumEthChainBrowser().get_token_list(address)
+        refresh = False
+        if context.args and context.args[0] == "refresh":
+            if userid not in self.config.ADMIN_USERIDS:
+                await self._reply_text(update.message, "Only admin can refresh the tokens.")
+                return
+            # drop the cached tokens of all addresses, such as after an airdrop
+            self.token_balances.clear()
+            refresh = True
+        tokens = await self.token_balances.get(address, refresh)
         reply = f"Your address: {address}\n"
         null = True
         for i in tokens:
@@ -584,14 +947,14 @@ class DataExchanger:
             reply += (
                 f"more details view page: https://explorer.rumsystem.net/address/{address}/tokens"
             )
-        await update.message.reply_text(reply)
+        await self._reply_text(update.message, reply)
 
     async def set_commands(self):
         my_commands = self.config.TG_COMMANDS or []
         commands = await self.app.bot.get_my_commands()
         flag = False
         for cmd in commands:
-            if [cmd.command, cmd.description] not in my_commands:
+            if (cmd.command, cmd.description) not in my_commands:
                 flag = True
                 break
         if flag:
@@ -625,6 +988,14 @@ class DataExchanger:
                 self.handle_channel_message,
             )
         )
+        # pinned message of group:
+        # reset the cached pinned post
+        self.app.add_handler(
+            MessageHandler(
+                filters.StatusUpdate.PINNED_MESSAGE & filters.Chat(self.config.TG_GROUP_ID),
+                self.handle_pinned_message,
+            )
+        )
         # group message:
         # send to rum group as comment of the pinned post or the reply-to post
         self.app.add_handler(
@@ -1,23 +1,152 @@
+import asyncio
+import datetime
+import functools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from quorum_mininode_py import RumAccount
-from sqlalchemy import create_engine
+from sqlalchemy import UniqueConstraint, bindparam, create_engine, event, or_, select
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
 
-from rum_with_telegram.module import Base, Relation, UsedKey, User
+from rum_with_telegram.cache import LRUCache
+from rum_with_telegram.module import Base, Outbox, Relation, RumCursor, TgFile, UsedKey, User
 
 logger = logging.getLogger(__name__)
 
+# built once, it is on the hot path of group and channel messages
+TRX_SENT_QUERY = (
+    select(Relation)
+    .where(Relation.channel_message_id == bindparam("channel_message_id"))
+    .where(or_(Relation.chat_type.is_(None), Relation.chat_type.in_(["private", "supergroup"])))
+    .where(Relation.trx_id.isnot(None))
+    .order_by(Relation.chat_type.asc().nullsfirst(), Relation.id)
+    .limit(1)
+)
+
+
+def is_memory_sqlite(db_url: str):
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
+def engine_options(db_url: str, pool_options: dict = None):
+    """the kwargs of create_engine, the pool size is only passed to the default QueuePool,
+    which is not used by the sqlite in memory, nor by the sqlite file before sqlalchemy 2.0"""
+    options = dict(pool_options or {})
+    url = make_url(db_url)
+    if is_memory_sqlite(db_url) or not issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        options.pop("pool_size", None)
+        options.pop("max_overflow", None)
+    return options
+
+
+def set_sqlite_pragmas(engine, busy_timeout: int = 5000, mmap_size: int = 64 * 1024 * 1024):
+    """apply the pragmas on each new connection of sqlite.
+    the WAL mode lets the readers work with one writer, so the processes sharing the file wait
+    for busy_timeout milliseconds instead of raising "database is locked" """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.close()
+
 
 class DBHandle:
-    def __init__(self, db_url: str, echo: bool = False):
+    def __init__(
+        self,
+        db_url: str,
+        echo: bool = False,
+        engine=None,
+        pool_options: dict = None,
+        sqlite_pragmas: dict = None,
+        buffer_size: int = 0,
+        user_cache_size: int = 0,
+        user_cache_ttl: float = 300,
+    ):
+        """pool_options such as pool_size, max_overflow, pool_recycle and pool_pre_ping;
+        sqlite_pragmas such as busy_timeout and mmap_size;
+        buffer_size is the max number of relations pending to insert, 0 to insert at once;
+        user_cache_size is the max number of users and their used keys in memory, 0 to disable"""
         logger.info("db_url: %s", db_url)
-        self.engine = create_engine(db_url, echo=echo)
+        # the tables are created by the caller if the engine is given
+        if engine is None:
+            self.engine = create_engine(db_url, echo=echo, **engine_options(db_url, pool_options))
+            set_sqlite_pragmas(self.engine, **(sqlite_pragmas or {}))
+        else:
+            self.engine = engine
         self.Session = sessionmaker(bind=self.engine)
-        Base.metadata.create_all(self.engine)
+        if engine is None:
+            Base.metadata.create_all(self.engine)
+        # the write-behind relations, the batches of _flushing are kept visible until committed
+        self.buffer_size = buffer_size
+        self._pending = []
+        self._flushing = []
+        self._buffer_lock = threading.Lock()
+        # the users and used keys by user_id, invalidated by add_or_update of this handle
+        self.users = LRUCache(user_cache_size, user_cache_ttl) if user_cache_size else None
+        self.used_keys = LRUCache(user_cache_size, user_cache_ttl) if user_cache_size else None
+
+    def _invalidate(self, table, user_ids):
+        cache = {User: self.users, UsedKey: self.used_keys}.get(table)
+        if cache is not None:
+            for user_id in user_ids:
+                cache.pop(user_id)
+
+    def _pending_relations(self, **kwargs):
+        """the pending relations matching kwargs, as transient Relation objects"""
+        if not self.buffer_size:
+            return []
+        with self._buffer_lock:
+            rows = [row for batch in self._flushing for row in batch] + self._pending
+        return [
+            Relation(**row)
+            for row in rows
+            if all(row.get(key) == value for key, value in kwargs.items())
+        ]
+
+    def _buffer(self, payloads: list):
+        with self._buffer_lock:
+            self._pending.extend(payloads)
+            is_full = len(self._pending) >= self.buffer_size
+        if is_full:
+            self.flush()
+        return True
+
+    def flush(self):
+        """insert the pending relations with one commit, return the number of rows.
+        no lock is held during the insert, the concurrent flushes insert their own batches,
+        so the greenlets of AsyncDBHandle on one thread never block each other"""
+        with self._buffer_lock:
+            rows, self._pending = self._pending, []
+            if rows:
+                self._flushing.append(rows)
+        if not rows:
+            return 0
+        try:
+            if not self._add_all(Relation, rows):
+                # a bad row, such as a duplicated chat message, fails the others
+                for row in rows:
+                    self._add(Relation, row)
+        finally:
+            with self._buffer_lock:
+                self._flushing = [batch for batch in self._flushing if batch is not rows]
+        logger.info("flush relations: %s", len(rows))
+        return len(rows)
 
     def init_user(self, userid, username=None, pvtkey=None, is_cover=False):
+        from quorum_mininode_py import RumAccount
+
         _user = self.get_first_user(userid)
         if _user:
             if not is_cover:
@@ -31,20 +160,46 @@ class DBHandle:
             "pvtkey": account.pvtkey,
             "pubkey": account.pubkey,
             "address": account.address,
+            # the export archive is of the old pubkey
+            "export_trx_id": None,
+            "export_count": None,
+            "export_size": None,
         }
         self.add_or_update(User, user, "user_id")
         return self.get_first_user(userid)
 
     def get_first(self, table, payload: dict, pk: str):
         with self.Session() as session:
-            return session.query(table).filter_by(**{pk: payload[pk]}).first()
+            obj = session.query(table).filter_by(**{pk: payload[pk]}).first()
+        if obj is None and table is Relation:
+            obj = next(iter(self._pending_relations(**{pk: payload[pk]})), None)
+        return obj
 
     def get_first_user(self, userid):
-        return self.get_first(User, {"user_id": userid}, "user_id")
+        if self.users is None:
+            return self.get_first(User, {"user_id": userid}, "user_id")
+        user = self.users.get(userid)
+        if user is None:
+            user = self.get_first(User, {"user_id": userid}, "user_id")
+            if user is not None:
+                self.users.set(userid, user)
+        return user
+
+    def get_used_keys(self, userid):
+        if self.used_keys is None:
+            return self.get_all(UsedKey, {"user_id": userid}, "user_id")
+        used = self.used_keys.get(userid)
+        if used is None:
+            used = self.get_all(UsedKey, {"user_id": userid}, "user_id")
+            self.used_keys.set(userid, used)
+        return used
 
     def get_all(self, table, payload: dict, pk: str):
         with self.Session() as session:
-            return session.query(table).filter_by(**{pk: payload[pk]}).all()
+            objs = session.query(table).filter_by(**{pk: payload[pk]}).all()
+        if table is Relation:
+            objs += self._pending_relations(**{pk: payload[pk]})
+        return objs
 
     def get_trx_sent_by(self, channel_message_id, chat_type):
         with self.Session() as session:
@@ -53,43 +208,212 @@ class DBHandle:
                 .filter_by(channel_message_id=channel_message_id, chat_type=chat_type)
                 .all()
             )
-            for relation in relations:
-                if relation and relation.trx_id:
-                    return relation
-            return None
+        relations += self._pending_relations(
+            channel_message_id=channel_message_id, chat_type=chat_type
+        )
+        for relation in relations:
+            if relation and relation.trx_id:
+                return relation
+        return None
 
     def get_trx_sent(self, channel_message_id):
-        relation = self.get_trx_sent_by(channel_message_id, None)
-        if not relation:
-            relation = self.get_trx_sent_by(channel_message_id, "private")
-        if not relation:
-            relation = self.get_trx_sent_by(channel_message_id, "supergroup")
-        return relation
+        """the relation with trx of the channel message, prefer chat_type None, private, supergroup"""
+        with self.Session() as session:
+            relation = (
+                session.execute(TRX_SENT_QUERY, {"channel_message_id": channel_message_id})
+                .scalars()
+                .first()
+            )
+        if not self.buffer_size:
+            return relation
+        ranks = {None: 0, "private": 1, "supergroup": 2}
+        relations = [relation] if relation else []
+        relations += [
+            obj
+            for obj in self._pending_relations(channel_message_id=channel_message_id)
+            if obj.trx_id and obj.chat_type in ranks
+        ]
+        # the row in db is before the pending one of the same chat_type
+        return min(relations, key=lambda obj: ranks[obj.chat_type], default=None)
 
     def is_exist(self, table, payload: dict, pk: str):
+        if table is Relation and self._pending_relations(**{pk: payload[pk]}):
+            return True
         with self.Session() as session:
             return session.query(table).filter_by(**{pk: payload[pk]}).count() > 0
 
+    def get_existing_trx_ids(self, trx_ids: list):
+        """return the trx_ids which already exist in relations, by one query"""
+        if not trx_ids:
+            return set()
+        with self.Session() as session:
+            rows = session.query(Relation.trx_id).filter(Relation.trx_id.in_(trx_ids)).all()
+        trx_ids = set(trx_ids)
+        pending = {obj.trx_id for obj in self._pending_relations() if obj.trx_id in trx_ids}
+        return {row.trx_id for row in rows} | pending
+
+    def get_recent_trx_ids(self, limit: int):
+        with self.Session() as session:
+            rows = (
+                session.query(Relation.trx_id)
+                .filter(Relation.trx_id.isnot(None))
+                .order_by(Relation.id.desc())
+                .limit(limit)
+                .all()
+            )
+        trx_ids = [row.trx_id for row in reversed(rows)]
+        trx_ids += [obj.trx_id for obj in self._pending_relations() if obj.trx_id]
+        return trx_ids[-limit:]
+
+    def _is_unique(self, table, pk: str):
+        """whether the conflict on pk can be detected by the db, so upsert can be used"""
+        column = table.__table__.columns[pk]
+        if column.primary_key or column.unique:
+            return True
+        return any(
+            isinstance(c, UniqueConstraint) and list(c.columns.keys()) == [pk]
+            for c in table.__table__.constraints
+        )
+
+    def _upsert(self, table, payloads: list, pk: str):
+        """the INSERT ... ON CONFLICT DO UPDATE statement, or None if it is not supported"""
+        if self.engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        elif self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            return None
+        if not self._is_unique(table, pk):
+            return None
+        stmt = insert(table).values(payloads)
+        columns = {key for payload in payloads for key in payload if key != pk}
+        if not columns:
+            return stmt.on_conflict_do_nothing(index_elements=[pk])
+        updates = {key: stmt.excluded[key] for key in columns}
+        # onupdate of the column is not applied by ON CONFLICT DO UPDATE
+        if "updated_at" in table.__table__.columns and "updated_at" not in updates:
+            updates["updated_at"] = func.now()
+        return stmt.on_conflict_do_update(index_elements=[pk], set_=updates)
+
+    def _add_or_update(self, session, table, payload, pk):
+        obj = session.query(table).filter_by(**{pk: payload[pk]}).first()
+        if obj:
+            for key, value in payload.items():
+                setattr(obj, key, value)
+        else:
+            session.add(table(**payload))
+
     def add_or_update(self, table, payload, pk):
         with self.Session() as session:
-            obj = session.query(table).filter_by(**{pk: payload[pk]}).first()
-            if obj:
-                session.query(table).filter_by(**{pk: payload[pk]}).update(payload)
-                logger.info("update to db: %s %s", pk, payload[pk])
-            else:
-                obj = table(**payload)
-                session.add(obj)
-                logger.info("add to db: %s %s", pk, payload[pk])
             try:
+                stmt = self._upsert(table, [payload], pk)
+                if stmt is not None:
+                    session.execute(stmt)
+                else:
+                    self._add_or_update(session, table, payload, pk)
+                session.commit()
+                logger.info("add or update to db: %s %s", pk, payload[pk])
+            except Exception as err:
+                session.rollback()
+                logger.info(err)
+        # after the commit, so a reader during it does not cache the old row again
+        if pk == "user_id":
+            self._invalidate(table, [payload[pk]])
+
+    def add_or_update_many(self, table, payloads: list, pk: str, chunk_size: int = 500):
+        """upsert many rows with one statement for each chunk, and one commit.
+        the payloads should have the same keys; the last one wins if pk is duplicated."""
+        payloads = list({payload[pk]: payload for payload in payloads}.values())
+        if not payloads:
+            return True
+        with self.Session() as session:
+            try:
+                for i in range(0, len(payloads), chunk_size):
+                    chunk = payloads[i : i + chunk_size]
+                    stmt = self._upsert(table, chunk, pk)
+                    if stmt is not None:
+                        session.execute(stmt)
+                        continue
+                    for payload in chunk:
+                        self._add_or_update(session, table, payload, pk)
+                    session.flush()
                 session.commit()
+                logger.info(
+                    "add or update to db: %s rows of %s", len(payloads), table.__tablename__
+                )
+                result = True
             except Exception as err:
                 session.rollback()
                 logger.info(err)
+                result = False
+        if pk == "user_id":
+            self._invalidate(table, [payload[pk] for payload in payloads])
+        return result
 
     def update_user_export_at(self, userid):
         return self.add_or_update(User, {"user_id": userid, "export_at": func.now()}, "user_id")
 
+    def update_user_export(self, userid, trx_id, count, size):
+        """the last exported trx, the number of trxs and the bytes of the export archive"""
+        export = {"export_trx_id": trx_id, "export_count": count, "export_size": size}
+        return self.add_or_update(User, {"user_id": userid, **export}, "user_id")
+
+    def get_rum_cursor(self, group_id):
+        return self.get_first(RumCursor, {"group_id": group_id}, "group_id")
+
+    def update_rum_cursor(self, group_id, trx_id, timestamp=None):
+        cursor = {"group_id": group_id, "trx_id": trx_id, "timestamp": timestamp}
+        return self.add_or_update(RumCursor, cursor, "group_id")
+
+    def get_file_ids(self, image_hashes: list):
+        """return {image_hash: file_id} of the images uploaded to telegram"""
+        if not image_hashes:
+            return {}
+        with self.Session() as session:
+            rows = session.query(TgFile).filter(TgFile.image_hash.in_(image_hashes)).all()
+            return {row.image_hash: row.file_id for row in rows}
+
+    def add_file_ids(self, file_ids: dict):
+        """add or replace the file_id of each image_hash"""
+        payloads = [{"image_hash": k, "file_id": v} for k, v in file_ids.items()]
+        return self.add_or_update_many(TgFile, payloads, "image_hash")
+
+    def add_outbox(self, key: str, payload: dict, trx_id: str):
+        """return the id of the new outbox item, or None if the key exists"""
+        with self.Session() as session:
+            obj = Outbox(key=key, payload=payload, trx_id=trx_id)
+            session.add(obj)
+            try:
+                session.commit()
+                return obj.id
+            except Exception as err:
+                session.rollback()
+                logger.info(err)
+                return None
+
+    def get_outbox_due_ids(self, limit: int = 100):
+        with self.Session() as session:
+            rows = (
+                session.query(Outbox.id)
+                .filter(Outbox.status == "pending")
+                .filter(or_(Outbox.next_at.is_(None), Outbox.next_at <= datetime.datetime.now()))
+                .order_by(Outbox.id)
+                .limit(limit)
+                .all()
+            )
+            return [row.id for row in rows]
+
+    def update_outbox(self, outbox_id, **kwargs):
+        with self.Session() as session:
+            session.query(Outbox).filter_by(id=outbox_id).update(kwargs)
+            session.commit()
+
     def add(self, table, payload):
+        if table is Relation and self.buffer_size:
+            return self._buffer([payload])
+        return self._add(table, payload)
+
+    def _add(self, table, payload):
         with self.Session() as session:
             obj = table(**payload)
             session.add(obj)
@@ -100,3 +424,157 @@ class DBHandle:
                 session.rollback()
                 logger.info(err)
                 return False
+
+    def add_all(self, table, payloads: list):
+        """add many rows with one commit"""
+        if table is Relation and self.buffer_size:
+            return self._buffer(payloads)
+        return self._add_all(table, payloads)
+
+    def _add_all(self, table, payloads: list):
+        with self.Session() as session:
+            session.add_all([table(**payload) for payload in payloads])
+            try:
+                session.commit()
+                return True
+            except Exception as err:
+                session.rollback()
+                logger.info(err)
+                return False
+
+
+def is_async_url(db_url: str):
+    """whether the driver of db_url is async, such as sqlite+aiosqlite or postgresql+asyncpg"""
+    return make_url(db_url).get_dialect().is_async
+
+
+class AsyncDBHandle:
+    """the awaitable DBHandle, with the same methods and arguments.
+    with an async driver in db_url, they run on the AsyncEngine without blocking the event loop;
+    or they run in a thread pool of max_workers, keep it 1 for sqlite to serialize the writes.
+    the pending relations of buffer_size are flushed every flush_interval seconds and on close."""
+
+    def __init__(
+        self,
+        db_url: str,
+        echo: bool = False,
+        max_workers: int = 1,
+        pool_options: dict = None,
+        sqlite_pragmas: dict = None,
+        buffer_size: int = 0,
+        flush_interval: float = 1.0,
+        user_cache_size: int = 0,
+        user_cache_ttl: float = 300,
+    ):
+        self._tables = None
+        self._flusher = None
+        self.flush_interval = flush_interval
+        if is_async_url(db_url):
+            from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+            self.async_engine = create_async_engine(
+                db_url, echo=echo, **engine_options(db_url, pool_options)
+            )
+            self.AsyncSession = async_sessionmaker(self.async_engine)
+            set_sqlite_pragmas(self.async_engine.sync_engine, **(sqlite_pragmas or {}))
+            self.db = DBHandle(
+                db_url,
+                echo,
+                engine=self.async_engine.sync_engine,
+                buffer_size=buffer_size,
+                user_cache_size=user_cache_size,
+                user_cache_ttl=user_cache_ttl,
+            )
+            self.executor = None
+            # sqlite serializes the writes, and shares one connection if it is in memory
+            self._serialize = self.async_engine.dialect.name == "sqlite"
+            self._lock = None
+        else:
+            self.async_engine = None
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+            # created in the pool, so the sqlite in memory is shared with the queries
+            self.db = self.executor.submit(
+                functools.partial(
+                    DBHandle,
+                    db_url,
+                    echo,
+                    pool_options=pool_options,
+                    sqlite_pragmas=sqlite_pragmas,
+                    buffer_size=buffer_size,
+                    user_cache_size=user_cache_size,
+                    user_cache_ttl=user_cache_ttl,
+                )
+            ).result()
+
+    async def _create_tables(self):
+        async with self.async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._run(self.db.flush)
+            except Exception as err:
+                logger.warning("flush relations error: %s", err)
+
+    async def _run(self, func, *args, **kwargs):
+        if self.async_engine is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+        if self._tables is None:
+            self._tables = asyncio.ensure_future(self._create_tables())
+        await self._tables
+        if not self._serialize:
+            return await self._run_sync(func, *args, **kwargs)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await self._run_sync(func, *args, **kwargs)
+
+    async def _run_sync(self, func, *args, **kwargs):
+        # run_sync calls func in a greenlet, where the sync sessions on the sync_engine
+        # await the async driver; the AsyncSession itself connects only if it is used
+        async with self.AsyncSession() as session:
+            return await session.run_sync(lambda _: func(*args, **kwargs))
+
+    async def init_user(self, userid, username=None, pvtkey=None, is_cover=False):
+        # the known user is returned from the cache, without a thread or greenlet
+        if not is_cover and self.db.users is not None:
+            user = self.db.users.get(userid)
+            if user is not None:
+                return user
+        return await self._run(self.db.init_user, userid, username, pvtkey, is_cover)
+
+    async def get_first_user(self, userid):
+        if self.db.users is not None:
+            user = self.db.users.get(userid)
+            if user is not None:
+                return user
+        return await self._run(self.db.get_first_user, userid)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            if self.db.buffer_size and self._flusher is None:
+                self._flusher = asyncio.ensure_future(self._flush_loop())
+            return await self._run(attr, *args, **kwargs)
+
+        return method
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self.db.buffer_size:
+            await self._run(self.db.flush)
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        else:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {"ndjson": "jsonl", "json": "json"}
+
+
+async def export_trxs(trxs, fmt: str = "ndjson", spool_size: int = 1024 * 1024):
+    """write the async iterable trxs one by one to a gzip-compressed temp file, which is kept in
+    memory up to spool_size bytes and then rolled over to disk. return (file, count, last_trx_id),
+    the file is at position 0 and should be closed by the caller."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    count = 0
+    last_trx_id = None
+    try:
+        with gzip.GzipFile(fileobj=file, mode="wb") as gz:
+            if fmt == "json":
+                gz.write(b"[")
+            async for trx in trxs:
+                line = json.dumps(trx, ensure_ascii=False).encode("utf-8")
+                if fmt == "json":
+                    gz.write(b"\n" if count == 0 else b",\n")
+                    gz.write(line)
+                else:
+                    gz.write(line + b"\n")
+                count += 1
+                last_trx_id = trx.get("TrxId")
+            if fmt == "json":
+                gz.write(b"\n]\n")
+    except BaseException:
+        file.close()
+        raise
+    logger.info("export %s trxs, %s bytes", count, file.tell())
+    file.seek(0)
+    return file, count, last_trx_id
+
+
+def export_filename(prefix: str, fmt: str = "ndjson") -> str:
+    return f"{prefix}.{EXPORT_FORMATS[fmt]}.gz"
+
+
+class ExportArchive:
+    """the NDJSON archive of the exported trxs of each pubkey on disk, appended with the new trxs
+    of each export. the gzip members can be concatenated, so the archive is never decompressed."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, pubkey: str):
+        return os.path.join(self.cache_dir, export_filename(pubkey))
+
+    def size(self, pubkey: str):
+        try:
+            return os.path.getsize(self.path(pubkey))
+        except OSError:
+            return 0
+
+    def _append(self, pubkey: str, file, size: int):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(pubkey)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as archive:
+            # drop the bytes appended by an export which was not saved to db
+            archive.truncate(size)
+            archive.seek(size)
+            shutil.copyfileobj(file, archive)
+            archive.flush()
+            os.fsync(archive.fileno())
+            return archive.tell()
+
+    async def append(self, pubkey: str, file, size: int):
+        """append file to the archive which was size bytes at the last export, return the new size"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._append, pubkey, file, size)
+
+    def open(self, pubkey: str):
+        return open(self.path(pubkey), "rb")
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from rum_with_telegram.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """the bytes of telegram files, downloaded once and keyed by file_unique_id"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 600):
+        self.files = LRUCache(max_bytes, ttl, getsize=len)
+        self._downloading = {}
+
+    async def download(self, bot, media) -> bytes:
+        """media is a telegram PhotoSize, Document, etc. which has file_id and file_unique_id"""
+        key = media.file_unique_id
+        data = self.files.get(key)
+        if data is not None:
+            return data
+        # the concurrent downloads of the same file share one request
+        if key not in self._downloading:
+            self._downloading[key] = asyncio.ensure_future(self._download(bot, media))
+        return await asyncio.shield(self._downloading[key])
+
+    async def _download(self, bot, media):
+        key = media.file_unique_id
+        try:
+            file = await bot.get_file(media.file_id)
+            data = bytes(await file.download_as_bytearray())
+            self.files.set(key, data)
+            logger.info("download %s %s bytes", key, len(data))
+            return data
+        finally:
+            self._downloading.pop(key, None)
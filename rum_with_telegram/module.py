@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, String, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -14,8 +14,9 @@ class Relation(Base):
     group_id = Column(String, default=None)  # rum
     trx_id = Column(String, index=True, default=None)  # rum
     trx_type = Column(String, default=None)  # rum
-    rum_post_id = Column(String, default=None)
+    rum_post_id = Column(String, index=True, default=None)
     rum_post_url = Column(String, default=None)
+    root_post_id = Column(String, default=None)  # rum, the post which the comment belongs to
     chat_type = Column(String, default=None)  # tg
     chat_message_id = Column(Integer, index=True, default=None)  # tg
     channel_message_id = Column(Integer, index=True, default=None)  # tg
@@ -23,7 +24,10 @@ class Relation(Base):
     pubkey = Column(String, default=None)  # rum
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
-    __table_args__ = (UniqueConstraint("chat_type", "chat_message_id"),)
+    __table_args__ = (
+        UniqueConstraint("chat_type", "chat_message_id"),
+        Index("ix_relations_channel_message_id_chat_type", "channel_message_id", "chat_type"),
+    )
 
 
 class User(Base):
@@ -36,6 +40,10 @@ class User(Base):
     pubkey = Column(String, unique=True, default=None)
     address = Column(String, unique=True, default=None)
     export_at = Column(DateTime, default=None)
+    # the last exported trx, the number of trxs and the bytes of the export archive
+    export_trx_id = Column(String, default=None)  # rum
+    export_count = Column(Integer, default=None)
+    export_size = Column(Integer, default=None)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
@@ -45,3 +53,44 @@ class UsedKey(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, index=True)
     pvtkey = Column(String)
+
+
+class RumCursor(Base):
+    """the last trx handled from rum group to telegram channel"""
+
+    __tablename__ = "rum_cursors"
+
+    id = Column(Integer, primary_key=True)
+    group_id = Column(String, unique=True, index=True, default=None)  # rum
+    trx_id = Column(String, default=None)  # rum
+    timestamp = Column(String, default=None)  # rum
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+
+
+class TgFile(Base):
+    """the telegram file_id of image which has been uploaded"""
+
+    __tablename__ = "tg_files"
+
+    id = Column(Integer, primary_key=True)
+    image_hash = Column(String, unique=True, index=True, default=None)  # sha256 of image bytes
+    file_id = Column(String, default=None)  # tg
+    created_at = Column(DateTime, default=func.now())
+
+
+class Outbox(Base):
+    """the telegram messages waiting to be sent to rum group"""
+
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, index=True)  # idempotency key of the tg message
+    trx_id = Column(String, default=None)  # rum, fixed before sending so retries are idempotent
+    payload = Column(JSON, default=None)
+    status = Column(String, index=True, default="pending")  # pending, done or failed
+    attempts = Column(Integer, default=0)
+    error = Column(String, default=None)
+    next_at = Column(DateTime, default=None)  # not retry before it
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
@@ -0,0 +1,88 @@
+import asyncio
+import datetime
+import logging
+import uuid
+
+from rum_with_telegram.module import Outbox
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorkers:
+    """the async workers to drain the outbox table of AsyncDBHandle, retry the failed with backoff.
+    handle is an async function to process one Outbox row, raise to retry it later."""
+
+    def __init__(self, db, handle, workers: int = 4, max_attempts: int = 10, interval: float = 5):
+        self.db = db
+        self.handle = handle
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.queue = None
+        self.tasks = []
+        self.pending = set()
+
+    def _schedule(self, item_id):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if item_id not in self.pending:
+            self.pending.add(item_id)
+            self.queue.put_nowait(item_id)
+
+    async def put(self, key: str, payload: dict):
+        """add to outbox, the item with a key which exists is ignored. return whether it is added"""
+        # the trx_id and post_id are fixed here, so the retries post the same trx
+        payload = dict(payload, post_id=str(uuid.uuid4()))
+        item_id = await self.db.add_outbox(key, payload, str(uuid.uuid4()))
+        if item_id is None:
+            return False
+        self._schedule(item_id)
+        return True
+
+    def start(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.tasks = [asyncio.ensure_future(self._dispatch())]
+        self.tasks += [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        logger.info("outbox workers started: %s", self.workers)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _dispatch(self):
+        """schedule the items left by the last run and the items to retry"""
+        while True:
+            for item_id in await self.db.get_outbox_due_ids():
+                self._schedule(item_id)
+            await asyncio.sleep(self.interval)
+
+    async def _work(self):
+        while True:
+            item_id = await self.queue.get()
+            try:
+                await self._process(item_id)
+            except Exception as err:
+                logger.error("outbox %s error: %s", item_id, err)
+            finally:
+                self.pending.discard(item_id)
+
+    async def _process(self, item_id):
+        item = await self.db.get_first(Outbox, {"id": item_id}, "id")
+        if not item or item.status != "pending":
+            return
+        attempts = item.attempts + 1
+        try:
+            await self.handle(item)
+        except Exception as err:
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            next_at = datetime.datetime.now() + datetime.timedelta(seconds=min(2**attempts, 600))
+            logger.warning("outbox %s attempt %s %s: %s", item.key, attempts, status, err)
+            await self.db.update_outbox(
+                item_id, status=status, attempts=attempts, error=str(err), next_at=next_at
+            )
+            return
+        await self.db.update_outbox(item_id, status="done", attempts=attempts, error=None)
+        logger.info("outbox %s done", item.key)
@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from quorum_mininode_py import RumAccount
+from quorum_mininode_py.api import LightNodeAPI
+from quorum_mininode_py.crypto.account import check_pvtkey
+from quorum_mininode_py.crypto.trx import trx_encrypt
+from requests.adapters import HTTPAdapter
+
+from rum_with_telegram.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def pack_trx(group_id: str, aes_key: bytes, data: dict, pvtkey: str, trx_id: str = None):
+    """encrypt and sign the trx; cpu bound, so it can run in another process"""
+    return trx_encrypt(group_id, aes_key, data, check_pvtkey(pvtkey), trx_id)
+
+
+class SignerPool:
+    """the lru pool of api clients for each private key.
+    the clients share the group and http session of MiniNode, and never change the account of it."""
+
+    def __init__(self, rum, maxsize: int = 1024):
+        self.rum = rum
+        self.apis = LRUCache(maxsize)
+
+    def get(self, pvtkey: str):
+        api = self.apis.get(pvtkey)
+        if api is None:
+            # the age key is only used to announce, so it is shared with MiniNode
+            account = RumAccount(pvtkey, self.rum.account.age_pvtkey)
+            api = LightNodeAPI(
+                SimpleNamespace(group=self.rum.group, http=self.rum.http, account=account)
+            )
+            self.apis.set(pvtkey, api)
+        return api
+
+
+class AsyncRumAPI:
+    """the awaitable api of MiniNode, the blocking http requests run in a bounded thread pool"""
+
+    def __init__(self, rum, max_workers: int = 4, signers: int = 1024, sign_workers: int = 0):
+        self.rum = rum
+        self.signers = SignerPool(rum, signers)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rum_api")
+        # build and sign trxs in other processes, or in the thread pool if sign_workers is 0
+        self.process_pool = ProcessPoolExecutor(sign_workers) if sign_workers > 0 else None
+        # keep-alive connections, one for each worker
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.rum.http.session.mount("http://", adapter)
+        self.rum.http.session.mount("https://", adapter)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_cpu(self, func, *args, **kwargs):
+        """run the cpu bound func, such as packing images into feed data, off the event loop"""
+        if self.process_pool:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.process_pool, functools.partial(func, *args, **kwargs)
+                )
+            except BrokenProcessPool as err:
+                logger.warning("process pool is broken, run in process: %s", err)
+                self.process_pool = None
+        return await self._run(func, *args, **kwargs)
+
+    async def get_content(self, **kwargs):
+        return await self._run(self.rum.api.get_content, **kwargs)
+
+    def _post_content(self, data: dict, trx_id: str = None, pvtkey: str = None):
+        api = self.signers.get(pvtkey) if pvtkey else self.rum.api
+        return api.post_content(data, trx_id)
+
+    async def post_content(self, data: dict, trx_id: str = None, pvtkey: str = None):
+        """post content signed by pvtkey, or by the account of MiniNode if pvtkey is None"""
+        if not self.process_pool:
+            return await self._run(self._post_content, data, trx_id, pvtkey)
+        group = self.rum.group
+        pvtkey = pvtkey or self.rum.account.pvtkey
+        trx = await self.run_cpu(pack_trx, group.group_id, group.aes_key, data, pvtkey, trx_id)
+        # pylint: disable=protected-access
+        return await self._run(self.rum.api._post_content, trx)
+
+    async def trx(self, trx_id: str):
+        return await self._run(self.rum.api.trx, trx_id)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False)
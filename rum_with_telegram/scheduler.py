@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """the adaptive interval of polling rum group.
+    poll again at once when new trxs come, back off exponentially to max_interval when idle."""
+
+    def __init__(self, min_interval: float = 1.0, max_interval: float = 30.0, backoff: float = 2.0):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = max(backoff, 1.0)
+        self.interval = min_interval
+        self.is_busy = False
+        # unix time of the latest handled trx
+        self.last_trx_at = None
+
+    @property
+    def lag(self):
+        """seconds between now and the latest handled trx"""
+        if self.last_trx_at is None:
+            return None
+        return max(time.time() - self.last_trx_at, 0.0)
+
+    def update(self, new_trxs: int, timestamp=None):
+        """update the state by the result of one poll"""
+        if timestamp:
+            # the TimeStamp of trx is in nanoseconds
+            self.last_trx_at = int(timestamp) / 1e9
+        if new_trxs:
+            self.is_busy = True
+            self.interval = self.min_interval
+        else:
+            if not self.is_busy:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            self.is_busy = False
+
+    async def wait(self):
+        if self.is_busy:
+            return
+        logger.debug("poll after %.1fs, lag %s", self.interval, self.lag)
+        await asyncio.sleep(self.interval)
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from rum_with_telegram.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# the smaller one is sent first
+PRIORITY_REPLY = 0
+PRIORITY_RELAY = 10
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity tokens for bursts"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self):
+        """seconds to wait until a token is available"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """no token is available in the next seconds"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class SendQueue:
+    """the queue of all messages sent by telegram bot.
+    sends are ordered by priority, limited by a global and a per-chat token bucket,
+    and retried after the seconds told by RetryAfter.
+    the items of a chat without token are parked in its own queue, the other chats keep sending."""
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        group_rate: float = 0.33,
+        max_retries: int = 5,
+    ):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets = LRUCache(10000)
+        self._counter = itertools.count()
+        # chat_id: the heap of items waiting to be sent to the chat
+        self._chats = {}
+        self._wakeup = None
+        self._worker = None
+
+    def _get_chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # channels and groups are limited harder than private chats
+            is_group = str(chat_id).startswith(("-", "@"))
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate)
+            self.chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._work())
+
+    def _put(self, item):
+        heapq.heappush(self._chats.setdefault(item[2], []), item)
+        self._wakeup.set()
+
+    async def send(self, chat, func, *args, priority: int = PRIORITY_RELAY, **kwargs):
+        """queue func(*args, **kwargs), which sends to chat, and wait for its result"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        item = [priority, next(self._counter), chat, func, args, kwargs, future, 0]
+        self._put(item)
+        return await future
+
+    def _next_item(self):
+        """the first item of the chats which have a token now,
+        or None and the seconds until a chat has a token (None if no item is waiting)"""
+        first, wait = None, None
+        for chat_id, items in list(self._chats.items()):
+            while items and items[0][6].done():
+                heapq.heappop(items)
+            if not items:
+                del self._chats[chat_id]
+                continue
+            delay = self._get_chat_bucket(chat_id).delay()
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif first is None or items[0] < first:
+                first = items[0]
+        return first, wait
+
+    async def _wait(self, timeout):
+        """sleep for timeout seconds, or until a new item is queued"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            item, wait = self._next_item()
+            if item is None:
+                await self._wait(wait)
+                continue
+            # only the global limit blocks all chats, an item queued meanwhile may be sent first
+            delay = self.global_bucket.delay()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+            chat_id = item[2]
+            heapq.heappop(self._chats[chat_id])
+            if not self._chats[chat_id]:
+                del self._chats[chat_id]
+            self.global_bucket.consume()
+            self._get_chat_bucket(chat_id).consume()
+            asyncio.ensure_future(self._call(item))
+
+    async def _call(self, item):
+        chat_id, func, args, kwargs, future = item[2:7]
+        try:
+            result = await func(*args, **kwargs)
+        except RetryAfter as err:
+            item[7] += 1
+            if item[7] > self.max_retries:
+                if not future.done():
+                    future.set_exception(err)
+                return
+            logger.warning("send to %s retry after %ss", chat_id, err.retry_after)
+            # only the chat is paused, keep the place in its queue with the same priority and counter
+            self._get_chat_bucket(chat_id).pause(err.retry_after)
+            self._put(item)
+        except Exception as err:
+            if not future.done():
+                future.set_exception(err)
+        else:
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from rum_with_telegram.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBalances:
+    """the token lists of addresses from the rum-eth chain browser, cached for ttl seconds.
+    the blocking requests run in a thread pool, the concurrent lookups of one address share one."""
+
+    def __init__(self, ttl: float = 300, maxsize: int = 10000, max_workers: int = 2):
+        self.browser = None
+        self.tokens = LRUCache(maxsize, ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tokens")
+        self._fetching = {}
+
+    async def get(self, address: str, refresh: bool = False):
+        """the token list of address, refresh to skip the cache"""
+        if not refresh:
+            tokens = self.tokens.get(address)
+            if tokens is not None:
+                return tokens
+        if address not in self._fetching:
+            self._fetching[address] = asyncio.ensure_future(self._fetch(address))
+        return await asyncio.shield(self._fetching[address])
+
+    async def _fetch(self, address: str):
+        try:
+            if self.browser is None:
+                # web3 is slow to import, only when /tokens is used
+                from quorum_eth_py import RumEthChainBrowser
+
+                self.browser = RumEthChainBrowser()
+            loop = asyncio.get_running_loop()
+            tokens = await loop.run_in_executor(self.executor, self.browser.get_token_list, address)
+            self.tokens.set(address, tokens)
+            logger.info("get token list of %s: %s", address, len(tokens))
+            return tokens
+        finally:
+            self._fetching.pop(address, None)
+
+    def clear(self):
+        self.tokens.clear()
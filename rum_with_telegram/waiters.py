@@ -0,0 +1,29 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Waiters:
+    """the futures keyed by such as channel_message_id, resolved by the writer in this process"""
+
+    def __init__(self):
+        self._futures = {}
+
+    def wait(self, key):
+        """register a future before checking the db, so a resolve after the check is not missed"""
+        future = asyncio.get_running_loop().create_future()
+        self._futures.setdefault(key, []).append(future)
+        return future
+
+    def discard(self, key, future):
+        futures = self._futures.get(key, [])
+        if future in futures:
+            futures.remove(future)
+        if not futures:
+            self._futures.pop(key, None)
+
+    def resolve(self, key, value):
+        for future in self._futures.pop(key, []):
+            if not future.done():
+                future.set_result(value)
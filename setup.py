@@ -33,6 +33,10 @@ setuptools.setup(
         "python-telegram-bot==20.2",
         "quorum-data-py>=1.2.7",
         "quorum-mininode-py",
-        "sqlalchemy",
+        "sqlalchemy>=2.0",
     ],
+    extras_require={
+        # for the async drivers in DB_URL, such as sqlite+aiosqlite
+        "async": ["aiosqlite", "greenlet"],
+    },
 )